@@ -1,13 +1,11 @@
-#! /usr/bin/python
+#! /usr/bin/env python3
 # This app acts as flashcards, without the need for a server or paper cards!
 
-import csv
-import pprint
-import random
-import pandas
-import json
+import collections
+import numpy
+import os
 import sys
-from openpyxl import Workbook
+import tempfile
 
 
 '''TODO:
@@ -15,95 +13,280 @@ from openpyxl import Workbook
 	Create tags and allow that as parameter (-tags tag1 tag2 ...)
 	Input filename (-f, -n) or set name (-set)
 	Have yaml map set names to files
-	Create scorecard with Passes, Fails, and Pct
 '''
 
 
-def check_params():
-	# Ensures that each question contains a question, answer, pass, and fail field.
-	return
+# Cards are drawn from one shared generator, a batch at a time. Selection
+# weights are recomputed from the scores before every batch.
+_RNG = numpy.random.default_rng()
+_CARD_BATCH = 8
 
 
 def get_flashcard_file():
 	# Grabs the file the user passed in, or uses a template "sports" sheet if not provided by user
+	args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
 	try:
-		return sys.argv[1]
-	except:
+		return args[0]
+	except IndexError:
 		return "flashcard_sets/sports.xlsx"
 
 
 def get_filetype(flashcard_file):
-	return flashcard_file.split(".")[-1:][0]
+	return os.path.splitext(flashcard_file)[1][1:].lower()
 
 
-def get_flashcard_set(filename, filetype):
-	# Returns a filename of the flashcards file. For this example, it's 
-	# the 'flashcards.csv' file.
+# Errors that mean a parquet file could not be written or read, e.g. a read-only
+# folder, a column pyarrow cannot store, a corrupt file or no pyarrow at all.
+_PARQUET_ERRORS = (OSError, ValueError, TypeError, NotImplementedError, ImportError)
 
-	if filetype == 'csv':
-		reader = csv.DictReader(open(filename, 'rb'))
-		for row in reader:
-			flashcards_json.append(row)
-		return flashcards_json
 
-	if filetype == 'xlsx':
-		return json.loads(pandas.read_excel(filename).to_json(orient='records'))
+def _write_parquet(flashcards, path):
+	# Writes to a temporary file and renames it into place, so an interrupted
+	# write never leaves a truncated parquet file behind.
+	# The data is fsynced before the rename so the rename cannot outlive it.
+	# Each write gets its own temp file, so concurrent runs cannot swap in
+	# each other's half-written data.
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'wb') as tmp_file:
+			flashcards.to_parquet(tmp_file)
+			tmp_file.flush()
+			os.fsync(tmp_file.fileno())
+		os.replace(tmp, path)
+	except BaseException:
+		try:
+			os.remove(tmp)
+		except OSError:
+			pass
+		raise
+
+
+def _load_cached(filename, parse):
+	# Parsing csv/xlsx text is slow, so the first load is cached as parquet
+	# next to the source and reused until the source is modified again.
+	cache = filename + '.parquet'
+	try:
+		fresh = os.path.getmtime(cache) >= os.path.getmtime(filename)
+	except OSError:
+		fresh = False
+	# The cache is only a speed-up: if it cannot be read or written, the set
+	# is parsed from its source and the cache rewritten where possible.
+	if fresh:
+		try:
+			return _load_parquet(cache)
+		except _PARQUET_ERRORS:
+			pass
+	flashcards = parse(filename)
+	try:
+		_write_parquet(flashcards, cache)
+	except _PARQUET_ERRORS:
+		pass
+	return flashcards
+
+
+def _parse_csv(filename):
+	# csv sets are parsed by pandas straight into a DataFrame (one column per
+	# field) rather than building a dict per row. The file is memory-mapped.
+	import pandas
+	return pandas.read_csv(filename, encoding='utf-8', engine='c', memory_map=True)
+
+
+def _parse_xlsx(filename):
+	import pandas
+	return pandas.read_excel(filename, engine='calamine')
+
+
+def _load_csv(filename):
+	return _load_cached(filename, _parse_csv)
+
+
+def _load_xlsx(filename):
+	return _load_cached(filename, _parse_xlsx)
+
+
+def _load_parquet(filename):
+	import pandas
+	return pandas.read_parquet(filename)
+
+
+_LOADERS = {
+	'csv': _load_csv,
+	'xlsx': _load_xlsx,
+	'parquet': _load_parquet,
+}
+
+
+def get_flashcard_set(filename):
+	# Returns the flashcards stored in the given file as a DataFrame, using the
+	# loader registered for its file extension.
+	filetype = get_filetype(filename)
+	try:
+		loader = _LOADERS[filetype]
+	except KeyError:
+		raise ValueError("Unsupported flashcard file type '" + filetype + "' for " + filename
+			+ "; expected one of: " + ", ".join(sorted(_LOADERS))) from None
+	return loader(filename)
+
+
+def _score_column(flashcards, column):
+	# Returns a writable int64 array of the given score column, or zeros if the
+	# set has not been scored yet. Missing (NaN) scores count as zero.
+	if column in flashcards:
+		return flashcards[column].fillna(0).to_numpy(dtype=numpy.int64, copy=True)
+	return numpy.zeros(len(flashcards), dtype=numpy.int64)
+
+
+def _weights(passes, fails):
+	# Chance of drawing each card: cards that are failed more than they are
+	# passed come up more often, unseen cards sit in the middle.
+	weights = fails + 1.0
+	weights /= passes + fails + 2.0
+	weights /= weights.sum()
+	return weights
 
 
-def study_flashcards_session(flashcards_json_list):
+def study_flashcards_session(flashcards):
 	# Conducts a flashcard study session. This prompts a question to the user, asks 
 	# if their answer was successfull, and updates the question "score" accordingly.
+	# Scores are counted in plain int64 arrays during the session and stored back
+	# into the DataFrame's "passes" and "fails" columns at the end.
 
-	def choose_question():
-		# For now, rendomly generates and returns a number (question ID).
-		return random.choice(flashcards_json_list)
+	passes = _score_column(flashcards, "passes")
+	fails = _score_column(flashcards, "fails")
+	earlier_passes = passes.sum()
+	earlier_fails = fails.sum()
+
+	# Every card's prompts are built once, a whole column at a time. The index is
+	# reset so each Card's Index is its row position in the passes/fails arrays.
+	prompts = flashcards[["Question", "Answer"]].astype(str).reset_index(drop=True)
+	prompts.columns = ["question_prompt", "answer_prompt"]
+	prompts["question_prompt"] = "Question: " + prompts["question_prompt"] + "\nYour Answer: "
+	prompts["answer_prompt"] = ("\033[1m\033[92m\nAnswer:\n\033[0m" + prompts["answer_prompt"]
+		+ "\n\nWas your answer correct? (y/n): ")
+
+	pending_cards = collections.deque()
 
-	def update_score(question_json, success):
+	def choose_question():
+		# Picks a card, weighted towards poorly scored ones, and returns it as a
+		# Card(Index, question_prompt, answer_prompt) namedtuple. A whole batch is
+		# selected at once and handed out in turn.
+		if not pending_cards:
+			question_ids = _RNG.choice(len(flashcards), size=_CARD_BATCH, p=_weights(passes, fails))
+			batch = prompts.iloc[question_ids]
+			pending_cards.extend(batch.itertuples(name="Card"))
+		return pending_cards.popleft()
+
+	def update_score(question_id, success):
 		# Updates the question score based on run.
-		return
+		if success:
+			passes[question_id] += 1
+		else:
+			fails[question_id] += 1
+
+	def ask(prompt):
+		# Writes the whole prompt at once and reads back one line. End of input
+		# counts as "quit".
+		sys.stdout.write(prompt)
+		sys.stdout.flush()
+		line = sys.stdin.readline()
+		if not line:
+			return "quit"
+		return line.rstrip("\n")
+
+	trailer = ""
 
 	while True:
-		print "\n----------\n"
 		success_criteria = ''
-		question_json = choose_question()
+		card = choose_question()
+		prompt = trailer + "\n----------\n\n" + card.question_prompt
 
 		while success_criteria != "y":
 			
-			user_input = raw_input("Question: " + question_json["Question"] + "\nYour Answer: ")
+			user_input = ask(prompt)
 			
 			if user_input == "quit":
 				break
 
-			print "\033[1m\033[92m\nAnswer:\n\033[0m" + str(question_json["Answer"])
+			success_criteria = ask(card.answer_prompt)
 
-			success_criteria = raw_input("\nWas your answer correct? (y/n): ")
+			if success_criteria == "quit":
+				break
 
-			print "\n"
+			update_score(card.Index, success_criteria == "y")
+
+			trailer = "\n\n"
+			prompt = trailer + card.question_prompt
 			
-		if user_input == "quit":
+		if "quit" in (user_input, success_criteria):
 			break
 
+	flashcards["passes"] = passes
+	flashcards["fails"] = fails
+
+	# The scorecard covers this session only, not scores loaded from earlier ones.
+	session_passes = passes.sum() - earlier_passes
+	session_answers = session_passes + fails.sum() - earlier_fails
+	if session_answers:
+		print("\nPasses: %d, Fails: %d, Pct: %d%%" % (
+			session_passes, session_answers - session_passes, 100 * session_passes // session_answers))
+
+
+
+def export_xlsx_requested():
+	# The --export-xlsx flag also writes the session's cards out as xlsx.
+	return "--export-xlsx" in sys.argv[1:]
 
 
-def end_study_session(json_list,filename,filetype):
-	print "Finished study session, saving " + str(filename)
+def get_saved_file(filename):
+	# Returns where a set's scores are saved. Passing a saved file itself writes
+	# back to it rather than adding another suffix.
+	if filename.endswith(".saved.parquet"):
+		return filename
+	return filename + ".saved.parquet"
+
+
+def load_saved_scores(flashcards, filename):
+	# Copies passes/fails from the set's last saved session onto the cards with
+	# the same question, so scores carry over between runs of the source file.
+	saved_file = get_saved_file(filename)
+	if saved_file == filename:
+		return
+	try:
+		saved = _load_parquet(saved_file)
+	except _PARQUET_ERRORS:
+		return
+	if not {"Question", "passes", "fails"}.issubset(saved.columns):
+		return
+	scores = saved.drop_duplicates("Question").set_index("Question")
+	for column in ("passes", "fails"):
+		flashcards[column] = flashcards["Question"].map(scores[column]).fillna(0).astype("int64")
+
+
+def end_study_session(flashcards,filename):
+	saved_file = get_saved_file(filename)
+	print("Finished study session, saving " + saved_file)
+
+	try:
+		_write_parquet(flashcards, saved_file)
+	except _PARQUET_ERRORS as error:
+		print("Could not save " + saved_file + ": " + str(error))
 
-	if filetype == "xlsx":
-		pandas.read_json(json.dumps(json_list), orient='records').to_excel("saved_flashcards.xlsx")
+	if export_xlsx_requested():
+		flashcards.to_excel("saved_flashcards.xlsx")
 
-	print "Done."
+	print("Done.")
 
 
 def main():
 	flashcard_file = get_flashcard_file()
-	flashcard_filetype = get_filetype(flashcard_file)
 
-	flashcard_set_list_jsons = get_flashcard_set(flashcard_file,flashcard_filetype)
+	flashcard_set = get_flashcard_set(flashcard_file)
+	load_saved_scores(flashcard_set, flashcard_file)
 
-	study_flashcards_session(flashcard_set_list_jsons)
+	study_flashcards_session(flashcard_set)
 
-	#end_study_session(flashcard_set_list_jsons,flashcard_file,flashcard_filetype)
-	print "Done with study session."
+	end_study_session(flashcard_set,flashcard_file)
+	print("Done with study session.")
 
 
 if __name__ == '__main__':